@@ -1,2 +1,2 @@
-from .distances import AmplitudePhaseDistance
+from .distances import AmplitudePhaseDistance, AmplitudePhaseDistanceMatrix, clear_srsf_cache
 from .geometry import SquareRootSlopeFramework, WarpingManifold
\ No newline at end of file
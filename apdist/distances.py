@@ -1,20 +1,102 @@
 import numpy as np
+from numba import njit, prange
+import os
+import hashlib
+import multiprocessing
+import threading
+from collections import OrderedDict
+from functools import partial, wraps
+from concurrent.futures import ProcessPoolExecutor
 
 from .geometry import *
+from .geometry import _interp_uniform_point, _interp_monotone
 
+# Fast-math flags without 'nnan'/'ninf' so NaNs from invalid warpings still propagate
+_FASTMATH = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+@njit(fastmath=_FASTMATH, cache=True)
 def _grad(f, binsize):
     n = f.shape[0]
-    g = np.zeros(n)
-    h = binsize*np.arange(1,n+1)
-    g[0] = (f[1] - f[0])/(h[1]-h[0])
-    g[-1] = (f[-1] - f[(-2)])/(h[-1]-h[-2])
+    g = np.empty_like(f)
+    g[0] = (f[1] - f[0])/binsize
+    g[-1] = (f[-1] - f[-2])/binsize
 
-    h = h[2:]-h[0:-2]
-    g[1:-1] = (f[2:]-f[0:-2])/h[0]
+    inv = 1.0/(2*binsize)
+    for i in range(1, n-1):
+        g[i] = (f[i+1] - f[i-1])*inv
 
     return g
 
-def _amplitude_distance(time, q1, q2, gam):
+@njit(fastmath=_FASTMATH, cache=True)
+def _amplitude_distance_kernel(time, q1, q2, gam, sqrt_gam_dev, dt):
+    """Fused single pass over the domain computing the amplitude distance
+
+    Evaluates the warped SRSF `q2` and the trapezoidal integral of the
+    squared difference without allocating any intermediate arrays. A
+    positive `dt` marks `time` as uniform with that spacing.
+    """
+    M = time.shape[0]
+    span = time[M-1] - time[0]
+    acc = 0.0
+    y_prev = 0.0
+    j = 0
+    for i in range(M):
+        x = span * gam[i] + time[0]
+        if dt > 0:
+            q2w = _interp_uniform_point(x, time[0], dt, q2)
+        else:
+            q2w, j = _interp_monotone(x, time, q2, j)
+        qw = q2w * sqrt_gam_dev[i]
+        d = qw - q1[i]
+        y = d * d
+        if i > 0:
+            acc += 0.5 * (y_prev + y) * (time[i] - time[i-1])
+        y_prev = y
+
+    return np.sqrt(acc)
+
+@njit(fastmath=_FASTMATH, cache=True)
+def _phase_distance_kernel(time, sqrt_gam_dev):
+    """Trapezoidal integral of `sqrt_gam_dev` followed by the arc-cosine"""
+    acc = 0.0
+    for i in range(1, time.shape[0]):
+        acc += 0.5 * (sqrt_gam_dev[i-1] + sqrt_gam_dev[i]) * (time[i] - time[i-1])
+    if acc > 1:
+        acc = 1.0
+    elif acc < -1:
+        acc = -1.0
+
+    return np.arccos(acc)
+
+@njit(fastmath=_FASTMATH, cache=True)
+def _sqrt_gam_dev(gam):
+    """Square root of the derivative of a warping function on [0,1]"""
+    M = gam.shape[0]
+    gam_dev = _grad(gam, 1.0 / (M - 1))
+
+    return np.sqrt(gam_dev)
+
+@njit(parallel=True, fastmath=_FASTMATH, cache=True)
+def _distance_batch(time, Q, I, J, gams, dt, da, dp):
+    """Amplitude and phase distances between the rows `Q[I]` and `Q[J]` in parallel
+
+    Rows are indexed inside the loop so no (n_pairs, n_domain) copies of 
+    `Q` are made. As in `_amplitude_distance`, pairs whose SRSF difference
+    sums to zero are at zero distance.
+    """
+    for b in prange(gams.shape[0]):
+        q1 = Q[I[b]]
+        q2 = Q[J[b]]
+        if (q1 - q2).sum() == 0:
+            da[b] = 0
+            dp[b] = 0
+            continue
+        sqrt_gam_dev = _sqrt_gam_dev(gams[b])
+        da[b] = _amplitude_distance_kernel(time, q1, q2, gams[b], 
+                                           sqrt_gam_dev, dt)
+        dp[b] = _phase_distance_kernel(time, sqrt_gam_dev)
+
+def _amplitude_distance(time, q1, q2, gam, sqrt_gam_dev=None, dt=None):
     """ Compute Amplitude distance between two SRSF
     
     Parameters:
@@ -25,6 +107,10 @@ def _amplitude_distance(time, q1, q2, gam):
             SRSFs of two functions q = SRSF(f)
         gam : numpy array of shape (n_domain, )
             Warping function aligning q2 to q1  
+        sqrt_gam_dev : numpy array of shape (n_domain, ), optional
+            Precomputed square root of the derivative of `gam`
+        dt : float, optional
+            Spacing of `time` when it is uniform
                         
     Returns:
     ===========
@@ -35,19 +121,14 @@ def _amplitude_distance(time, q1, q2, gam):
     if delta.sum() == 0:
         dist = 0
     else:
-        M = len(time)
-        gam_dev = _grad(gam, 1 / np.double(M - 1))
-        tmp = np.interp((time[-1] - time[0]) * gam + time[0], time, q2)
-
-        qw = tmp * np.sqrt(gam_dev)
-
-        y = (qw - q1) ** 2
-        tmp = np.diff(time)*(y[0:-1]+y[1:])/2
-        dist = np.sqrt(tmp.sum())
+        if sqrt_gam_dev is None:
+            sqrt_gam_dev = _sqrt_gam_dev(gam)
+        dist = _amplitude_distance_kernel(time, q1, q2, gam, sqrt_gam_dev,
+                                          0.0 if dt is None else dt)
        
     return dist
 
-def _phase_distance(time, q1, q2, gam):
+def _phase_distance(time, q1, q2, gam, sqrt_gam_dev=None):
     """ Compute Phase distance between two SRSF
     
     Parameters:
@@ -58,6 +139,8 @@ def _phase_distance(time, q1, q2, gam):
             SRSFs of two functions q = SRSF(f)
         gam : numpy array of shape (n_domain, )
             Warping function aligning q2 to q1        
+        sqrt_gam_dev : numpy array of shape (n_domain, ), optional
+            Precomputed square root of the derivative of `gam`
             
     Returns:
     ===========
@@ -68,19 +151,92 @@ def _phase_distance(time, q1, q2, gam):
     if delta.sum() == 0:
         dist = 0
     else:
-        M = len(time)
-        gam_dev = _grad(gam, 1 / np.double(M - 1))
-        theta = np.trapz(np.sqrt(gam_dev),x=time)
-        if theta > 1:
-            theta = 1
-        elif theta < -1:
-            theta = -1
-            
-        dist = np.arccos(theta)    
+        if sqrt_gam_dev is None:
+            sqrt_gam_dev = _sqrt_gam_dev(gam)
+        dist = _phase_distance_kernel(time, sqrt_gam_dev)
         
     return dist
     
-def AmplitudePhaseDistance(x, f1, f2, **kwargs):
+_SRSF_CACHE_SIZE = 64
+_srsf_cache = OrderedDict()
+_srsf_cache_lock = threading.Lock()
+
+def _digest(a):
+    return hashlib.blake2b(np.ascontiguousarray(a).tobytes(), digest_size=16).digest()
+
+def _array_key(a):
+    return (_digest(a), a.dtype.str, a.shape)
+
+def _get_or_compute_srsf(SRSF, f, time_key=None):
+    """Return `SRSF.to_srsf(f)`, reusing recently computed SRSFs
+    
+    `time_key` is the precomputed `_array_key(SRSF.time)`, letting callers
+    hash the domain once for several functions.
+    """
+    if time_key is None:
+        time_key = _array_key(SRSF.time)
+    key = (time_key, _array_key(f))
+    with _srsf_cache_lock:
+        q = _srsf_cache.pop(key, None)
+        if q is not None:
+            _srsf_cache[key] = q
+            return q
+    q = SRSF.to_srsf(f)
+    with _srsf_cache_lock:
+        _srsf_cache[key] = q
+        if len(_srsf_cache) > _SRSF_CACHE_SIZE:
+            _srsf_cache.popitem(last=False)
+
+    return q
+
+def clear_srsf_cache():
+    """Clear the SRSFs cached by `AmplitudePhaseDistance`"""
+    with _srsf_cache_lock:
+        _srsf_cache.clear()
+
+def _memoize_pair(func, maxsize=128):
+    """Memoize `func(x, f1, f2, ...)` on the content of its array arguments"""
+    cache = OrderedDict()
+    lock = threading.Lock()
+
+    @wraps(func)
+    def wrapper(x, f1, f2, *args, **kwargs):
+        x, f1, f2 = np.asarray(x), np.asarray(f1), np.asarray(f2)
+        key = (_array_key(x), _array_key(f1), _array_key(f2), args, 
+               tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            # e.g. array-valued get_gamma arguments: run uncached
+            return func(x, f1, f2, *args, **kwargs)
+        with lock:
+            out = cache.pop(key, None)
+            if out is not None:
+                cache[key] = out
+                return out
+        out = func(x, f1, f2, *args, **kwargs)
+        with lock:
+            cache[key] = out
+            if len(cache) > maxsize:
+                cache.popitem(last=False)
+
+        return out
+
+    def cache_clear():
+        with lock:
+            cache.clear()
+
+    wrapper.cache_clear = cache_clear
+
+    return wrapper
+
+def _normalize_domain(x):
+    """Affinely map the domain samples onto [0,1]"""
+    xmin = x.min()
+    return (x-xmin)/(x.max()-xmin)
+
+@_memoize_pair
+def AmplitudePhaseDistance(x, f1, f2, dtype=np.float64, **kwargs):
     """ Compute Amplitude-Phase distance between two functions
     
     Parameters:
@@ -89,6 +245,10 @@ def AmplitudePhaseDistance(x, f1, f2, **kwargs):
             Discrete sampling of the domain    
         f1, f2 : numpy array of shape (n_domain, )
             Query and target one-dimensional functions 
+        dtype : numpy dtype
+            Floating point precision of the inputs, SRSFs and warping 
+            functions (default, np.float64). The alignment and the 
+            distance integrals always run in double precision.
             
         kwargs : optional arguments for `get_gamma` function.
             See geometry.SqaureRootSlopeFramework for more details
@@ -101,14 +261,111 @@ def AmplitudePhaseDistance(x, f1, f2, **kwargs):
         dp : float
             Phase distance between the functions    
     """
-    time = x-min(x)/(max(x)-min(x))
+    if f1 is f2 or np.array_equal(f1, f2):
+        return 0.0, 0.0
+
+    x = np.asarray(x, dtype=dtype)
+    f1 = np.asarray(f1, dtype=dtype)
+    f2 = np.asarray(f2, dtype=dtype)
+    time = _normalize_domain(x)
     SRSF = SquareRootSlopeFramework(time)
-    q1 = SRSF.to_srsf(f1)
-    q2 = SRSF.to_srsf(f2)
-    gam = SRSF.get_gamma(q1, q2, **kwargs)            
+    time_key = _array_key(time)
+    q1 = _get_or_compute_srsf(SRSF, f1, time_key)
+    q2 = _get_or_compute_srsf(SRSF, f2, time_key)
+    # e.g. constant or shifted functions: nothing to align, both distances vanish
+    if np.array_equal(q1, q2):
+        return 0.0, 0.0
+    gam = SRSF.get_gamma(q1, q2, **kwargs).astype(dtype, copy=False)
     gam = (gam - gam[0]) / (gam[-1] - gam[0])
+    sqrt_gam_dev = _sqrt_gam_dev(gam)
+    
+    dp = _phase_distance(time, q1, q2, gam, sqrt_gam_dev=sqrt_gam_dev)
+    da = _amplitude_distance(time, q1, q2, gam, sqrt_gam_dev=sqrt_gam_dev,
+                             dt=SRSF._dt)
+
+    return da, dp
+
+def AmplitudePhaseDistanceMatrix(x, F, n_jobs=1, dtype=np.float64, **kwargs):
+    """ Compute pairwise Amplitude-Phase distances between a set of functions
     
-    dp = _phase_distance(time, q1, q2, gam)
-    da = _amplitude_distance(time, q1, q2, gam)
+    Parameters:
+    ===========
+        x : numpy array of shape (n_domain, )
+            Discrete sampling of the domain    
+        F : numpy array of shape (n_functions, n_domain)
+            One-dimensional functions stacked row-wise. Non C-contiguous
+            input is copied once so every per-function pass runs along
+            contiguous memory.
+        n_jobs : int or None
+            Number of worker processes used to compute the warping 
+            functions (default, 1 runs serially; None uses all 
+            processors). Starting the pool costs on the order of a 
+            second, so it only pays off for large sets of functions. 
+            Workers are spawned, so scripts should call this under 
+            `if __name__ == "__main__":`.
+        dtype : numpy dtype
+            Floating point precision of the inputs, SRSFs, warping 
+            functions and returned matrices (default, np.float64). The 
+            alignment and the distance integrals always run in double 
+            precision.
+            
+        kwargs : optional arguments for `get_gamma` function.
+            See geometry.SqaureRootSlopeFramework for more details
+              
+            
+    Returns:
+    ===========
+        DA : numpy array of shape (n_functions, n_functions)
+            Pairwise amplitude distances
+        DP : numpy array of shape (n_functions, n_functions)
+            Pairwise phase distances
+            
+    Only the pairs i < j are aligned and the matrices are symmetrised, 
+    i.e. `DA[i, j] = DA[j, i] = AmplitudePhaseDistance(x, F[i], F[j])[0]`. 
+    The alignment itself is not symmetric, so `DA[j, i]` may differ from 
+    `AmplitudePhaseDistance(x, F[j], F[i])[0]` (likewise for `DP`).
+    """
+    x = np.asarray(x, dtype=dtype)
+    F = np.ascontiguousarray(F, dtype=dtype)
+    time = _normalize_domain(x)
+    SRSF = SquareRootSlopeFramework(time)
+    Q = SRSF.to_srsf(F)
+    N = Q.shape[0]
+    I, J = np.triu_indices(N, k=1)
+    # functions with identical SRSFs are at zero distance; skip aligning them.
+    # Rows are labelled once so no (n_pairs, n_domain) comparison is built.
+    _, labels = np.unique(Q, axis=0, return_inverse=True)
+    labels = labels.reshape(-1)
+    distinct = labels[I] != labels[J]
+    I, J = I[distinct], J[distinct]
+
+    DA = np.zeros((N, N), dtype=dtype)
+    DP = np.zeros((N, N), dtype=dtype)
+    if len(I) == 0:
+        return DA, DP
+
+    get_gamma = partial(SRSF.get_gamma, **kwargs)
+    rows_I = (Q[i] for i in I)
+    rows_J = (Q[j] for j in J)
+    if n_jobs == 1:
+        gams = list(map(get_gamma, rows_I, rows_J))
+    else:
+        # spawn rather than fork: forking once Numba's thread pool is running can deadlock
+        context = multiprocessing.get_context("spawn")
+        # batch the pairs so the pickled SRSF is not shipped once per pair
+        chunksize = max(1, len(I) // (4 * (n_jobs or os.cpu_count() or 1)))
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=context) as executor:
+            gams = list(executor.map(get_gamma, rows_I, rows_J, chunksize=chunksize))
+    gams = np.asarray(gams, dtype=dtype)
+    gams -= gams[:, :1].copy()
+    gams /= gams[:, -1:].copy()
+
+    da = np.empty(len(I), dtype=dtype)
+    dp = np.empty(len(I), dtype=dtype)
+    dt = 0.0 if SRSF._dt is None else SRSF._dt
+    _distance_batch(time, Q, I, J, gams, dt, da, dp)
+
+    DA[I, J] = da
+    DP[I, J] = dp
 
-    return da, dp
\ No newline at end of file
+    return DA + DA.T, DP + DP.T
@@ -1,10 +1,104 @@
 import numpy as np
-from scipy import linalg
+from numba import njit
 import optimum_reparamN2 as orN2
-from scipy.interpolate import UnivariateSpline, interp1d
-from scipy.integrate import cumtrapz
-from collections import namedtuple
-import time, os, traceback, shutil, warnings
+from scipy.integrate import cumulative_trapezoid
+
+@njit(cache=True)
+def _interp_uniform_point(x, x0, dx, fp):
+    """Scalar equivalent of `np.interp` on the uniform grid `x0 + dx*arange(n)`"""
+    n = fp.shape[0]
+    s = (x - x0) / dx
+    if s != s:
+        # NaN query: propagate it like np.interp instead of indexing with int(NaN)
+        return s
+    if s <= 0:
+        return fp[0]
+    if s >= n-1:
+        return fp[n-1]
+    k = min(int(s), n-2)
+    w = s - k
+
+    return fp[k] + w * (fp[k+1] - fp[k])
+
+@njit(cache=True)
+def _interp_uniform(x, x0, dx, fp):
+    """Equivalent of `np.interp` on a uniform grid, indexing instead of searching"""
+    out = np.empty(x.shape[0])
+    for i in range(x.shape[0]):
+        out[i] = _interp_uniform_point(x[i], x0, dx, fp)
+
+    return out
+
+@njit(cache=True)
+def _interp_monotone(x, xp, fp, j):
+    """Scalar equivalent of `np.interp(x, xp, fp)` starting from bracket `j`
+
+    Consecutive queries from a monotone warping only move the bracket
+    forward, so a full sweep costs O(n) instead of a binary search per
+    point. Returns the interpolated value and the updated bracket.
+    """
+    n = xp.shape[0]
+    if x <= xp[0]:
+        return fp[0], 0
+    if x >= xp[n-1]:
+        return fp[n-1], n-2
+    while j < n-2 and xp[j+1] < x:
+        j += 1
+    while j > 0 and xp[j] > x:
+        j -= 1
+    w = (x - xp[j]) / (xp[j+1] - xp[j])
+
+    return fp[j] + w * (fp[j+1] - fp[j]), j
+
+@njit(cache=True)
+def _interp_sweep(x, xp, fp):
+    """Equivalent of `np.interp` walking the bracket along `x`, in O(n) for monotone `x`"""
+    out = np.empty(x.shape[0])
+    j = 0
+    for i in range(x.shape[0]):
+        out[i], j = _interp_monotone(x[i], xp, fp, j)
+
+    return out
+
+@njit(cache=True)
+def _warp_q_gamma_kernel(time, q, gam, dt):
+    """Single pass computing `q(gam) * sqrt(gam')` as in `warp_q_gamma`
+
+    The derivative follows the stencils of `np.gradient`; a positive `dt`
+    marks `time` as uniform with that spacing.
+    """
+    M = time.shape[0]
+    span = time[M-1] - time[0]
+    out = np.empty(M)
+    j = 0
+    for i in range(M):
+        if i == 0:
+            gam_dev = (gam[1] - gam[0]) / (time[1] - time[0])
+        elif i == M-1:
+            gam_dev = (gam[M-1] - gam[M-2]) / (time[M-1] - time[M-2])
+        elif dt > 0:
+            gam_dev = (gam[i+1] - gam[i-1]) / (2.0 * dt)
+        else:
+            hs = time[i] - time[i-1]
+            hd = time[i+1] - time[i]
+            gam_dev = (hs*hs*gam[i+1] + (hd*hd - hs*hs)*gam[i] - hd*hd*gam[i-1]) / (hs*hd*(hd + hs))
+        x = span * gam[i] + time[0]
+        if dt > 0:
+            v = _interp_uniform_point(x, time[0], dt, q)
+        else:
+            v, j = _interp_monotone(x, time, q, j)
+        out[i] = v * np.sqrt(gam_dev)
+
+    return out
+
+def _trapezoid_weights(time):
+    """Weights `w` such that `np.trapz(y, time) == w @ y`"""
+    w = np.empty(len(time))
+    w[1:-1] = 0.5*(time[2:] - time[:-2])
+    w[0] = 0.5*(time[1] - time[0])
+    w[-1] = 0.5*(time[-1] - time[-2])
+
+    return w
 
 class SquareRootSlopeFramework:
     """Square Root Slope Framework (SRSF)
@@ -13,6 +107,10 @@ class SquareRootSlopeFramework:
     ===========
         time : numpy array of shape (n_domain, )
             Discrete mapping of domain into [0,1]
+        uniform : bool or None
+            Whether `time` is uniformly spaced. Detected from `time`
+            when None (default); uniform grids use specialized
+            gradient and interpolation routines.
             
     Attributes:
     ===========
@@ -22,25 +120,59 @@ class SquareRootSlopeFramework:
         warp_q_gamma : Apply warping to SRSF of a function
         get_gamma : Compute warping function given two SRSF
     """
-    def __init__(self, time):
+    def __init__(self, time, uniform=None):
         self.time = time 
+        dt = (time[-1] - time[0]) / (len(time) - 1)
+        if uniform is None:
+            # tolerance scales with dt (a fixed atol accepts fine non-uniform
+            # grids) plus the rounding error of the grid's own dtype
+            eps = np.finfo(np.result_type(time, 1.0)).eps
+            atol = 1e-9*abs(dt) + 4*eps*np.abs(time).max()
+            uniform = np.allclose(time, time[0] + dt*np.arange(len(time)), rtol=0, atol=atol)
+        self._uniform = bool(uniform)
+        self._dt = float(dt) if self._uniform else None
+        # the dynamic programming extension only accepts C-contiguous doubles
+        self._time_c = np.require(time, dtype=np.float64, requirements='C')
+
+    def _gradient(self, f):
+        if self._uniform:
+            return np.gradient(f, self._dt, axis=-1)
+        return np.gradient(f, self.time, axis=-1)
+
+    def _interp(self, x, fp):
+        # the compiled routines need arrays; np.interp accepted any array-like
+        x = np.asarray(x, dtype=np.float64)
+        fp = np.asarray(fp, dtype=np.float64)
+        if self._uniform:
+            return _interp_uniform(x, self.time[0], self._dt, fp)
+        return _interp_sweep(x, self.time, fp)
 
-    def to_srsf(self, f):
+    def to_srsf(self, f, smooth=False):
         """Compute SRSF of a function
         
         Parameters:
         ===========
-            f : numpy array of shape (n_domain, )
-                Discrete evaluation of a function
+            f : numpy array of shape (..., n_domain)
+                Discrete evaluation of a function, or a stack of
+                functions along the leading axes
+            smooth : bool
+                Differentiate an interpolating spline instead of using
+                finite differences (default, False)
                 
         Returns:
         ========
-            q : numpy array of shape (n_domain, )
+            q : numpy array of shape (..., n_domain)
                 Discrete SRSF evaluation of a function            
         """
-        spl = UnivariateSpline(self.time, f, s=0)
-        grad = spl.derivative(n=1)(self.time)
-        q = grad / np.sqrt(np.fabs(grad) + 1e-3)
+        if smooth:
+            from scipy.interpolate import UnivariateSpline
+            def spline_grad(y):
+                spl = UnivariateSpline(self.time, y, s=0)
+                return spl.derivative(n=1)(self.time)
+            grad = np.apply_along_axis(spline_grad, -1, f)
+        else:
+            grad = self._gradient(f)
+        q = np.copysign(np.sqrt(np.fabs(grad)), grad)
 
         return q
 
@@ -49,18 +181,18 @@ class SquareRootSlopeFramework:
         
         Parameters:
         ===========
-            q : numpy array of shape (n_domain, )
+            q : numpy array of shape (..., n_domain)
                 Discrete SRSF evaluation of a function  
-            f0 : float
+            f0 : float or numpy array of shape (..., )
                 Initial shift of a function (default, 0.0) 
                 
         Returns:
         ========
-            f : numpy array of shape (n_domain, )
+            f : numpy array of shape (..., n_domain)
                 Discrete evaluation of a function            
         """        
         integrand = q*np.fabs(q)
-        f = f0 + cumtrapz(integrand,self.time,initial=0)
+        f = np.asarray(f0)[..., None] + cumulative_trapezoid(integrand,self.time,axis=-1,initial=0)
         
         return f
 
@@ -79,8 +211,8 @@ class SquareRootSlopeFramework:
             f_temp : numpy array of shape (n_domain, )
                 Warped function 'f' with 'gam'         
         """ 
-        f_temp = np.interp((self.time[-1] - self.time[0]) * gam + self.time[0], 
-            self.time, f)
+        gam = np.asarray(gam, dtype=np.float64)
+        f_temp = self._interp((self.time[-1] - self.time[0]) * gam + self.time[0], f)
 
         return f_temp
         
@@ -99,11 +231,10 @@ class SquareRootSlopeFramework:
             q_temp : numpy array of shape (n_domain, )
                 Warped function 'q' with 'gam'         
         """ 
-        gam_dev = np.gradient(gam, self.time)
-        tmp = np.interp((self.time[-1] - self.time[0]) * gam + self.time[0], 
-            self.time, q)
-
-        q_temp = tmp * np.sqrt(gam_dev)
+        q = np.asarray(q, dtype=np.float64)
+        gam = np.asarray(gam, dtype=np.float64)
+        dt = self._dt if self._uniform else 0.0
+        q_temp = _warp_q_gamma_kernel(self.time, q, gam, dt)
 
         return q_temp
         
@@ -128,9 +259,9 @@ class SquareRootSlopeFramework:
         This function is a heavylift from the python 'fdasrsf' package.
         See https://github.com/jdtuck/fdasrsf_python for more details.       
         """ 
-        gamma = orN2.coptimum_reparam(np.ascontiguousarray(q1), 
-                                      self.time,
-                                      np.ascontiguousarray(q2), 
+        gamma = orN2.coptimum_reparam(np.require(q1, dtype=np.float64, requirements='C'), 
+                                      self._time_c,
+                                      np.require(q2, dtype=np.float64, requirements='C'), 
                                       lam, 
                                       grid_dim
                                      )
@@ -149,6 +280,7 @@ class WarpingManifold:
     ===========
         inner_product : Compute inner product between tangent vector of a function space
         norm : Compute the norm of a tangent vector of a function space
+        normalize : Scale a tangent vector of a function space to unit norm
         log : Apply logarthim function of warping manifold
         exp : Apply exponential function of warping manifold
         inverse : Compute inverse of a warping function
@@ -156,16 +288,22 @@ class WarpingManifold:
     """
     def __init__(self, time):
         self.time = time
+        self._trapw = _trapezoid_weights(time)
     
     def inner_product(self, tangent_vec_a, tangent_vec_b, base_point=None):
-        ip = np.trapz(tangent_vec_a*tangent_vec_b, self.time)
+        ip = float((self._trapw*tangent_vec_a) @ tangent_vec_b)
     
         return ip
 
     def norm(self, tangent_vec, base_point=None):
-        l2norm = np.sqrt(self.inner_product(tangent_vec, tangent_vec))
+        l2norm = np.sqrt(self._trapw @ (tangent_vec*tangent_vec))
 
         return l2norm
+
+    def normalize(self, tangent_vec, base_point=None):
+        unit_vec = tangent_vec * (1.0 / self.norm(tangent_vec))
+
+        return unit_vec
     
     def log(self, base_point, point):
         tmp = self.inner_product(base_point, point)
@@ -182,6 +320,18 @@ class WarpingManifold:
             exp_inv = theta / np.sin(theta) * (point - np.cos(theta)*base_point)
 
         return exp_inv, theta
+
+    def _log_batch(self, base_point, points):
+        """Apply `log` to every column of `points` at once"""
+        tmp = (self._trapw * base_point) @ points
+        theta = np.arccos(np.clip(tmp, -1, 1))
+
+        scale = np.zeros_like(theta)
+        mask = theta >= 1e-10
+        scale[mask] = theta[mask] / np.sin(theta[mask])
+        exp_inv = scale * (points - np.cos(theta) * base_point[:, None])
+
+        return exp_inv, theta
     
     def exp(self, point, base_point):
         norm = self.norm(base_point)
@@ -194,10 +344,10 @@ class WarpingManifold:
 
 
     def inverse(self, gam):
+        assert np.all(np.diff(gam) >= -1e-12), "warping function must be non-decreasing"
         N = gam.size
         x = np.linspace(0,1,N)
-        s = interp1d(gam, x)
-        gamI = s(x)
+        gamI = np.interp(x, gam, x)
         gamI = (gamI - gamI[0]) / (gamI[-1] - gamI[0])
         
         return gamI
@@ -206,7 +356,7 @@ class WarpingManifold:
         if gam.ndim > 1:
             T, n = gam.shape
         else:
-            return gamma_inverse(gam)
+            return self.inverse(gam)
 
         psi = np.zeros_like(gam)
         for k in range(0, n):
@@ -214,10 +364,7 @@ class WarpingManifold:
 
         # Find Direction
         mnpsi = psi.mean(axis=1)
-        a = mnpsi.repeat(n)
-        d1 = a.reshape(T, n)
-        d = (psi - d1) ** 2
-        dqq = np.sqrt(d.sum(axis=0))
+        dqq = np.linalg.norm(psi - mnpsi[:, None], axis=0)
         min_ind = dqq.argmin()
         mu = psi[:, min_ind]
 
@@ -229,10 +376,7 @@ class WarpingManifold:
         error = np.inf
 
         while (error > 1e-6) and (itr < maxiter):
-            vec = np.zeros((T, n))
-            for i in range(n):
-                out, theta = self.log(mu, psi[:, i])
-                vec[:, i] = out
+            vec, _ = self._log_batch(mu, psi)
 
             vbar = vec.mean(axis=1)
             error = self.norm(vbar)
@@ -240,7 +384,7 @@ class WarpingManifold:
             mu = self.exp(mu, stp * vbar)
             itr += 1
 
-        gam_mu = cumtrapz(mu * mu, self.time, initial=0)
+        gam_mu = cumulative_trapezoid(mu * mu, self.time, initial=0)
         gam_mu = (gam_mu - gam_mu.min()) / (gam_mu.max() - gam_mu.min())
         gamI = self.inverse(gam_mu)
 
@@ -8,7 +8,7 @@ setup(name="apdist",
       author_email='kiranvad@uw.edu',
       license='MIT',
       python_requires='==3.8',
-      install_requires=['numpy>=1.18.1','scipy', 'matplotlib', 
+      install_requires=['numpy>=1.18.1','scipy>=1.6', 'numba', 'matplotlib', 
       'Cython==0.29.30', 'cffi==1.15.0'],
       extras_require = {},
       packages=find_packages(),